@@ -1,8 +1,34 @@
-import psycopg2
+import asyncio
 import csv
+import io
+import itertools
+import json
+import logging
+import re
+import threading
+import traceback
 from abc import ABC, abstractmethod
-from typing import Dict, List, Generator
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from queue import Queue
+from typing import IO, Any, Dict, Generator, Iterable, List, Optional, Set, Tuple, Type
+
+from psycopg2 import sql
+from psycopg2.extensions import connection
+from psycopg2.pool import ThreadedConnectionPool
+
+try:
+    import asyncpg
+except ImportError:  # Optional, only needed when DB_BACKEND is "asyncpg"
+    asyncpg = None
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:  # Optional, only needed when CSV_READER is "pyarrow"
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
 
 # Database Configuration
 DB_CONFIG = {
@@ -13,24 +39,68 @@ DB_CONFIG = {
     "port": "your_port"
 }
 
+# Database driver: "psycopg2", or "asyncpg" for its binary protocol and asyncio connection pool
+DB_BACKEND = "psycopg2"
+
 # Input and output file paths
 INPUT_CSV_FILE = "input.csv"
 OUTPUT_CSV_FILE = "output.csv"
 
-# Queries (Modify based on your schema)
-GID_QUERY = "SELECT gid FROM your_table WHERE some_column = %s"
-EID_QUERY = "SELECT eid FROM your_table WHERE another_column = %s"
+# Buffer size for reading and writing the CSV files (larger buffers mean fewer syscalls)
+IO_BUFFER_SIZE = 4 * 1024 * 1024
 
-# Number of concurrent database queries (Tune based on DB performance)
+# CSV parser: "csv" for the standard library, or "pyarrow" for its multithreaded C++ reader
+CSV_READER = "csv"
+ARROW_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Lookup schema (Modify based on your schema): the table, key column and value column each output
+# column is looked up in, and the SQL type of the key column. Every query below is built from these.
+GID_LOOKUP = {"table": "your_table", "key_column": "some_column", "value_column": "gid", "key_type": "text"}
+EID_LOOKUP = {"table": "your_table", "key_column": "another_column", "value_column": "eid", "key_type": "text"}
+
+# Number of concurrent database connections (Tune based on DB performance)
 MAX_WORKERS = 5
 
+# Number of rows resolved per bulk lookup and held in memory at a time
+CHUNK_SIZE = 10_000
+
+# Maximum number of input values whose results are cached per column; the least recently used are evicted
+CACHE_SIZE = 100_000
+
+# Maximum number of chunks queued between pipeline stages, bounding memory on large inputs
+MAX_PENDING_CHUNKS = MAX_WORKERS * 2
+
+# Set-oriented lookup: takes an array of input values and returns a JSON object mapping each
+# value found to its result as text. Results are only written back out to CSV, so the server's text
+# is kept instead of converting each value to a Python object. Input values are sent as text and
+# cast to the key type in SQL, so non-text key columns work and the object is keyed by the input
+# strings unchanged.
+LOOKUP_TEMPLATE = ("SELECT json_object_agg(input_key, t.{value_column}::text) FROM unnest(%s::text[]) AS input_key "
+                   "JOIN {table} t ON t.{key_column} = input_key::{key_type}")
+
+# Both lookups in one statement, so a chunk needs a single round trip: one array parameter
+# and one result column per lookup
+BULK_QUERY = "SELECT ({}), ({})".format(LOOKUP_TEMPLATE.format(**GID_LOOKUP), LOOKUP_TEMPLATE.format(**EID_LOOKUP))
+
+# Queries prepared once per connection: query -> (statement name, parameter types)
+PREPARED_STATEMENTS = {
+    BULK_QUERY: ("bulk_stmt", "text[], text[]"),
+}
+
+# Resolve the whole file inside PostgreSQL with COPY instead of looking rows up from Python.
+# The input is loaded into a temporary table, joined to gid and eid with the lookup below
+# (see copy_join_query), and copied back out as CSV. Always runs on the psycopg2 backend.
+USE_COPY = False
+COPY_INPUT_TABLE = "csv_input"
+SCALAR_QUERY_TEMPLATE = "SELECT {value_column} FROM {table} WHERE {key_column} = {input}::{key_type} LIMIT 1"
+
 
 # --------------------- Interface Definitions ---------------------
 
 class IDatabase(ABC):
     """Database Interface"""
     @abstractmethod
-    def execute_query(self, query: str, param: str):
+    def bulk_lookup(self, query: str, key_sets: List[Iterable[str]]) -> List[Dict[str, Any]]:
         pass
 
     @abstractmethod
@@ -41,36 +111,223 @@ class IDatabase(ABC):
 class ICSVReader(ABC):
     """CSV Reader Interface"""
     @abstractmethod
-    def read_rows(self) -> Generator[Dict[str, str], None, None]:
+    def read_header(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def read_rows(self) -> Generator[Tuple, None, None]:
         pass
 
 
 class ICSVWriter(ABC):
-    """CSV Writer Interface"""
+    """CSV Writer Interface, used as a context manager around all writes"""
     @abstractmethod
-    def write_rows(self, data: List[Dict[str, str]]):
+    def __enter__(self) -> "ICSVWriter":
+        pass
+
+    @abstractmethod
+    def write_header(self, fieldnames: List[str]):
+        pass
+
+    @abstractmethod
+    def write_rows(self, data: List[Tuple]):
+        pass
+
+    @abstractmethod
+    def __exit__(self, exc_type, exc_value, traceback):
         pass
 
 
 # --------------------- Implementations ---------------------
 
+# Columns filled in for every input row: in place when the input already has them, appended otherwise
+OUTPUT_COLUMNS = ["gid", "eid"]
+
+
+def missing_output_columns(header: List[str]) -> List[str]:
+    """Returns the output columns that a header does not have yet, which are appended to each row"""
+    return [column for column in OUTPUT_COLUMNS if column not in header]
+
+
+def input_indexes(header: List[str]) -> Tuple[int, int]:
+    """Returns the positions of the input_gid and input_eid columns in a header"""
+    return header.index('input_gid'), header.index('input_eid')
+
+
+def make_row_type(header: List[str]) -> Type[Tuple]:
+    """Builds the row type for a file: its header columns followed by any missing output columns, empty by default"""
+    extra_columns = missing_output_columns(header)
+    return namedtuple("Row", header + extra_columns, rename=True, defaults=[None] * len(extra_columns))
+
+
+def copy_join_query(header: List[str]) -> sql.Composed:
+    """Builds the COPY join over an input table whose columns are named by position (column_0, column_1, ...)"""
+    gid_index, eid_index = input_indexes(header)
+    lookups = {
+        "gid": SCALAR_QUERY_TEMPLATE.format(input=f"NULLIF(i.column_{gid_index}, '')", **GID_LOOKUP),
+        "eid": SCALAR_QUERY_TEMPLATE.format(input=f"NULLIF(i.column_{eid_index}, '')", **EID_LOOKUP),
+    }
+
+    # Like make_row_type: the first gid/eid column of the input is replaced, missing ones are appended
+    columns = []
+    for index, name in enumerate(header):
+        if name in lookups and header.index(name) == index:
+            columns.append(sql.SQL("({}) AS {}").format(sql.SQL(lookups[name]), sql.Identifier(name)))
+        else:
+            columns.append(sql.SQL("i.{} AS {}").format(sql.Identifier(f"column_{index}"), sql.Identifier(name)))
+    for name in missing_output_columns(header):
+        columns.append(sql.SQL("({}) AS {}").format(sql.SQL(lookups[name]), sql.Identifier(name)))
+
+    return sql.SQL("SELECT {} FROM {} i").format(sql.SQL(", ").join(columns), sql.Identifier(COPY_INPUT_TABLE))
+
+
+def to_numbered_placeholders(query: str) -> str:
+    """Rewrites %s placeholders as the $1, $2, ... form used by PREPARE"""
+    counter = itertools.count(1)
+    return re.sub(r"%s", lambda _: f"${next(counter)}", query)
+
+
+def to_execute_statement(name: str, param_count: int) -> bytes:
+    """Builds the EXECUTE statement for a prepared query, already encoded for the driver"""
+    placeholders = ", ".join(["%s"] * param_count)
+    return f"EXECUTE {name}({placeholders})".encode()
+
+
+class PreparedConnection(connection):
+    """psycopg2 connection that records whether the lookup statements were prepared on it"""
+    prepared = False
+
+
 class PostgreSQLDatabase(IDatabase):
-    """Handles PostgreSQL Database connection and queries"""
+    """Handles PostgreSQL Database connections and queries through a thread-safe pool"""
     
     def __init__(self, config: Dict[str, str]):
-        self.conn = psycopg2.connect(**config)
-        self.cursor = self.conn.cursor()
+        self.pool = ThreadedConnectionPool(1, MAX_WORKERS, connection_factory=PreparedConnection, **config)
+
+        # EXECUTE text for each prepared query, built and encoded once rather than per call
+        self._execute_statements: Dict[str, bytes] = {
+            query: to_execute_statement(name, query.count("%s"))
+            for query, (name, _) in PREPARED_STATEMENTS.items()
+        }
+
+    def _prepare(self, conn: PreparedConnection):
+        """Prepares the known queries on a connection, once per connection"""
+        # Lookups are read-only, so skip the per-query BEGIN/ROLLBACK round trips
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for query, (name, param_types) in PREPARED_STATEMENTS.items():
+                cursor.execute(f"PREPARE {name}({param_types}) AS {to_numbered_placeholders(query)}")
+        conn.prepared = True
+
+    @contextmanager
+    def _cursor(self):
+        """Borrows a connection from the pool and yields a cursor on it"""
+        conn = self.pool.getconn()
+        if not conn.prepared:
+            try:
+                self._prepare(conn)
+            except BaseException:
+                # Statements prepared before the failure would make a retry fail, so discard the connection
+                self.pool.putconn(conn, close=True)
+                raise
+
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+        finally:
+            self.pool.putconn(conn)
+
+    def _execute(self, cursor, query: str, params: Tuple):
+        """Runs a query through its prepared statement when one exists"""
+        cursor.execute(self._execute_statements.get(query, query), params)
+
+    def bulk_lookup(self, query: str, key_sets: List[Iterable[str]]) -> List[Dict[str, Any]]:
+        """Executes a lookup query for several sets of keys at once and returns a key -> value dict per set"""
+        key_lists = [list(keys) for keys in key_sets]
+        if not any(key_lists):
+            return [{} for _ in key_lists]
+
+        with self._cursor() as cursor:
+            self._execute(cursor, query, tuple(key_lists))
+            # psycopg2 decodes the JSON objects, which are NULL when nothing was found
+            return [found or {} for found in cursor.fetchone()]
+
+    def copy_join(self, columns: List[str], source: IO[str], destination: IO[str], query: sql.Composable):
+        """Loads headerless CSV data into a temporary table and writes the result of a query over it as CSV"""
+        create_table = sql.SQL("CREATE TEMP TABLE {} ({})").format(
+            sql.Identifier(COPY_INPUT_TABLE),
+            sql.SQL(", ").join(sql.SQL("{} text").format(sql.Identifier(column)) for column in columns),
+        )
+
+        drop_table = f"DROP TABLE IF EXISTS {COPY_INPUT_TABLE}"
+
+        with self._cursor() as cursor:
+            cursor.execute(create_table)
+            try:
+                cursor.copy_expert(f"COPY {COPY_INPUT_TABLE} FROM STDIN WITH (FORMAT csv)",
+                                   source, size=IO_BUFFER_SIZE)
+                cursor.copy_expert(sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(query),
+                                   destination, size=IO_BUFFER_SIZE)
+            except BaseException:
+                # Clean up without letting a second failure hide the original error
+                try:
+                    cursor.execute(drop_table)
+                except Exception:
+                    logger.warning("Could not drop %s after a failed COPY", COPY_INPUT_TABLE, exc_info=True)
+                raise
+            cursor.execute(drop_table)
 
-    def execute_query(self, query: str, param: str):
-        """Executes a query and returns a single value"""
-        self.cursor.execute(query, (param,))
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+    def close(self):
+        """Closes all pooled database connections"""
+        self.pool.closeall()
+
+
+class AsyncPGDatabase(IDatabase):
+    """Handles PostgreSQL queries with asyncpg, running its connection pool on a background event loop"""
+    
+    def __init__(self, config: Dict[str, str]):
+        if asyncpg is None:
+            raise ImportError("AsyncPGDatabase requires the asyncpg package")
+
+        # Callers stay synchronous and may be threads; their queries run concurrently on one loop
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+        connect_args = {key: value for key, value in config.items() if key != "dbname"}
+        connect_args["database"] = config["dbname"]
+        # asyncpg prepares and caches each statement per connection on first use
+        try:
+            self.pool = self._run(asyncpg.create_pool(min_size=1, max_size=MAX_WORKERS, **connect_args))
+        except BaseException:
+            # close() is never called when construction fails, so stop the loop here
+            self._stop_loop()
+            raise
+
+    def _run(self, coro):
+        """Runs a coroutine on the event loop and waits for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def bulk_lookup(self, query: str, key_sets: List[Iterable[str]]) -> List[Dict[str, Any]]:
+        """Executes a lookup query for several sets of keys at once and returns a key -> value dict per set"""
+        key_lists = [list(keys) for keys in key_sets]
+        if not any(key_lists):
+            return [{} for _ in key_lists]
+
+        record = self._run(self.pool.fetchrow(to_numbered_placeholders(query), *key_lists))
+        # asyncpg returns JSON as text, and NULL when nothing was found
+        return [json.loads(found) if found else {} for found in record]
 
     def close(self):
-        """Closes the database connection"""
-        self.cursor.close()
-        self.conn.close()
+        """Closes the connection pool and stops the event loop"""
+        self._run(self.pool.close())
+        self._stop_loop()
+
+    def _stop_loop(self):
+        """Stops the event loop, waits for its thread and closes it"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
 
 
 class CSVFileReader(ICSVReader):
@@ -79,34 +336,169 @@ class CSVFileReader(ICSVReader):
     def __init__(self, file_path: str):
         self.file_path = file_path
 
-    def read_rows(self) -> Generator[Dict[str, str], None, None]:
-        """Yields rows from a CSV file as dictionaries"""
+    def read_header(self) -> List[str]:
+        """Returns the column names from the first line of the CSV file"""
         with open(self.file_path, mode="r", newline="", encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                yield row
-
+            return next(csv.reader(file), [])
+
+    def read_rows(self) -> Generator[Tuple, None, None]:
+        """Yields data rows from a CSV file as rows with gid and eid fields, skipping the header"""
+        with open(self.file_path, mode="r", newline="", encoding="utf-8", buffering=IO_BUFFER_SIZE) as file:
+            reader = csv.reader(file)
+            header = next(reader, [])
+            row_type = make_row_type(header)
+            width = len(header)
+            for values in reader:
+                if len(values) != width:
+                    # Like csv.DictReader: skip blank lines, fill missing fields with None, drop extra ones
+                    if not values:
+                        continue
+                    values = (values + [None] * width)[:width]
+                yield row_type(*values)
+
+
+class ArrowCSVReader(CSVFileReader):
+    """Reads CSV rows with pyarrow, parsing whole blocks outside the Python interpreter"""
+    
+    def __init__(self, file_path: str):
+        if pyarrow is None:
+            raise ImportError("ArrowCSVReader requires the pyarrow package")
+        super().__init__(file_path)
+
+    def read_rows(self) -> Generator[Tuple, None, None]:
+        """Yields data rows from a CSV file as rows with gid and eid fields, skipping the header.
+
+        Unlike CSVFileReader, rows with too few or too many fields cannot be padded or truncated
+        by pyarrow, so they are skipped with a warning.
+        """
+        header = self.read_header()
+        row_type = make_row_type(header)
+
+        # Name the columns by position, since header names may repeat, and skip the header line
+        column_names = [f"column_{index}" for index in range(len(header))]
+        read_options = pyarrow.csv.ReadOptions(block_size=ARROW_BLOCK_SIZE, column_names=column_names, skip_rows=1)
+        # Accept quoted newlines like the csv module and COPY do
+        parse_options = pyarrow.csv.ParseOptions(newlines_in_values=True, invalid_row_handler=self._skip_invalid_row)
+        # Keep every column as a string, as the csv module would, instead of inferring types
+        convert_options = pyarrow.csv.ConvertOptions(column_types={name: pyarrow.string() for name in column_names})
+
+        with pyarrow.csv.open_csv(self.file_path, read_options=read_options, parse_options=parse_options,
+                                  convert_options=convert_options) as reader:
+            for batch in reader:
+                columns = [column.to_pylist() for column in batch.columns]
+                for values in zip(*columns):
+                    yield row_type(*values)
+
+    @staticmethod
+    def _skip_invalid_row(row) -> str:
+        """Logs a row whose field count does not match the header, and tells pyarrow to skip it"""
+        logger.warning("Skipped row %s with %d fields instead of %d: %r",
+                       row.number, row.actual_columns, row.expected_columns, row.text)
+        return "skip"
+
+
+class CSVRowStream:
+    """File-like object serving rows as headerless CSV text, e.g. as the source of COPY FROM STDIN"""
+    
+    def __init__(self, rows: Iterable[Tuple], width: int):
+        self._rows = iter(rows)
+        self._width = width
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+
+    def read(self, size: int = -1) -> str:
+        """Returns up to `size` characters of CSV text, or all of it if `size` is negative"""
+        while size < 0 or self._buffer.tell() < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row[:self._width])
+
+        data = self._buffer.getvalue()
+        if size >= 0:
+            data, rest = data[:size], data[size:]
+        else:
+            rest = ""
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._buffer.write(rest)
+        return data
 
 class CSVFileWriter(ICSVWriter):
-    """Writes CSV rows efficiently"""
+    """Writes CSV rows efficiently to a file kept open across writes"""
     
     def __init__(self, file_path: str):
         self.file_path = file_path
-
-    def write_rows(self, data: List[Dict[str, str]]):
-        """Writes a list of dictionaries to a CSV file"""
-        if not data:
-            print("No data to write.")
-            return
-        
-        with open(self.file_path, mode="w", newline="", encoding="utf-8") as file:
-            writer = csv.DictWriter(file, fieldnames=data[0].keys())
-            writer.writeheader()
-            writer.writerows(data)
+        self._file = None
+        self._writer = None
+        self._empty = True
+
+    def __enter__(self) -> "CSVFileWriter":
+        """Opens the output file"""
+        self._file = open(self.file_path, mode="w", newline="", encoding="utf-8", buffering=IO_BUFFER_SIZE)
+        self._writer = csv.writer(self._file)
+        self._empty = True
+        return self
+
+    def write_header(self, fieldnames: List[str]):
+        """Writes the header line"""
+        self._writer.writerow(fieldnames)
+
+    def write_rows(self, data: List[Tuple]):
+        """Appends a list of rows to the open file"""
+        if data:
+            self._writer.writerows(data)
+            self._empty = False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Closes the output file"""
+        if self._empty and exc_type is None:
+            print("No data rows to write; the output contains only the header.")
+        self._file.close()
+        self._file = None
+        self._writer = None
 
 
 # --------------------- Main Processing Class ---------------------
 
+def chunked(rows: Iterable[Tuple], size: int) -> Generator[List[Tuple], None, None]:
+    """Groups rows into lists of at most `size` rows"""
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+class LRUCache:
+    """Thread-safe cache holding at most `size` entries, evicting the least recently used first"""
+    
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable[str]) -> Tuple[Dict[str, Any], Set[str]]:
+        """Returns the cached entries for some keys, along with the keys that are not cached"""
+        found = {}
+        missing = set()
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                else:
+                    missing.add(key)
+        return found, missing
+
+    def put_many(self, entries: Dict[str, Any]):
+        """Caches entries as the most recently used, then evicts entries beyond the size limit"""
+        with self._lock:
+            for key, value in entries.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
 class DataProcessor:
     """Processes the input CSV by querying the database and writing results to an output CSV"""
     
@@ -115,46 +507,202 @@ class DataProcessor:
         self.reader = reader
         self.writer = writer
 
-    def process_row(self, row: Dict[str, str]) -> Dict[str, str]:
-        """Processes a single row by fetching gid and eid"""
-        input_gid = row.get('input_gid')
-        input_eid = row.get('input_eid')
+        # Results already fetched from the database, keyed by input value (misses cached as None).
+        # Bounded by CACHE_SIZE, so memory stays flat on inputs with many distinct values.
+        self._gid_cache = LRUCache(CACHE_SIZE)
+        self._eid_cache = LRUCache(CACHE_SIZE)
+
+        # Positions of the input columns, resolved from the header when processing starts
+        self._input_indexes: Optional[Tuple[int, int]] = None
+
+    def _bulk_lookup(self, input_gids: Set[str], input_eids: Set[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Returns the results for some keys, looking up the ones missing from the caches in one query"""
+        gids, missing_gids = self._gid_cache.get_many(input_gids)
+        eids, missing_eids = self._eid_cache.get_many(input_eids)
+        if missing_gids or missing_eids:
+            found_gids, found_eids = self.db.bulk_lookup(BULK_QUERY, [missing_gids, missing_eids])
+            fetched_gids = {key: found_gids.get(key) for key in missing_gids}
+            fetched_eids = {key: found_eids.get(key) for key in missing_eids}
+            self._gid_cache.put_many(fetched_gids)
+            self._eid_cache.put_many(fetched_eids)
+            gids.update(fetched_gids)
+            eids.update(fetched_eids)
+        return gids, eids
+
+    def process_chunk(self, rows: List[Tuple]) -> List[Tuple]:
+        """Resolves gid and eid for a chunk of rows with at most one bulk query"""
+        gid_index, eid_index = self._input_indexes
+
+        # Collect the distinct non-empty input values
+        input_gids = {row[gid_index] for row in rows if row[gid_index]}
+        input_eids = {row[eid_index] for row in rows if row[eid_index]}
+
+        # Fetch uncached values from the database in at most one round trip. The results are kept
+        # for the whole chunk, since the caches may evict them while other chunks are resolved.
+        gids, eids = self._bulk_lookup(input_gids, input_eids)
+
+        # Add new values to rows
+        return [row._replace(gid=gids.get(row[gid_index]), eid=eids.get(row[eid_index])) for row in rows]
+
+    def _read_stage(self, read_queue: Queue, write_queue: Queue, errors: List[BaseException]):
+        """Reads the input in chunks onto the read queue, then signals every worker to stop"""
+        try:
+            gid_index, eid_index = self._input_indexes
+            for chunk in chunked(self.reader.read_rows(), CHUNK_SIZE):
+                # Rows without any input value need no lookup, so send them straight to the writer
+                lookup_rows = []
+                empty_rows = []
+                for row in chunk:
+                    if row[gid_index] or row[eid_index]:
+                        lookup_rows.append(row)
+                    elif row.gid is not None or row.eid is not None:
+                        # gid/eid columns that came with the input are cleared, as a lookup would
+                        empty_rows.append(row._replace(gid=None, eid=None))
+                    else:
+                        empty_rows.append(row)
+
+                if empty_rows:
+                    write_queue.put(empty_rows)
+                if lookup_rows:
+                    read_queue.put(lookup_rows)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            for _ in range(MAX_WORKERS):
+                read_queue.put(None)
+
+    def _resolve_chunk(self, chunk: List[Tuple]) -> Tuple[List[Tuple], Optional[Tuple[int, Tuple, Tuple, Exception]]]:
+        """Resolves a chunk, splitting a failing part in halves until only the failing rows are left out.
+
+        Returns the resolved rows, and (failed row count, first failed row, last failed row, first error)
+        when some rows had to be dropped.
+        """
+        resolved = []
+        failed = []
+        error = None
+        pending = [chunk]
+        while pending:
+            rows = pending.pop()
+            try:
+                resolved += self.process_chunk(rows)
+            except Exception as e:
+                if len(rows) > 1:
+                    # Resolve the first half first, so the rows stay in order
+                    middle = len(rows) // 2
+                    pending += [rows[middle:], rows[:middle]]
+                else:
+                    failed += rows
+                    error = error or e
+
+        if not failed:
+            return resolved, None
+        return resolved, (len(failed), failed[0], failed[-1], error)
+
+    def _lookup_stage(self, read_queue: Queue, write_queue: Queue, errors: List[Tuple[int, Tuple, Tuple, Exception]]):
+        """Resolves chunks from the read queue onto the write queue until told to stop"""
+        while (chunk := read_queue.get()) is not None:
+            rows, failure = self._resolve_chunk(chunk)
+            if failure is not None:
+                # The traceback's frames still reference their chunk; drop their variables so
+                # that recorded errors stay small, then report them once the pipeline is done
+                traceback.clear_frames(failure[-1].__traceback__)
+                errors.append(failure)
+            write_queue.put(rows)
+        write_queue.put(None)
 
-        # Fetch values from the database
-        gid = self.db.execute_query(GID_QUERY, input_gid) if input_gid else None
-        eid = self.db.execute_query(EID_QUERY, input_eid) if input_eid else None
+    def process_data(self):
+        """Reads, processes, and writes data as a pipeline, with all three stages running concurrently"""
+        header = self.reader.read_header()
+        if not header:
+            print("No data to write.")
+            return
 
-        # Add new values to row
-        row['gid'] = gid
-        row['eid'] = eid
-        return row
+        # Find the input columns up front, so a bad header fails before any output is written
+        self._input_indexes = input_indexes(header)
+
+        # Bounded queues keep each stage at most a few chunks ahead of the next one
+        read_queue: Queue = Queue(maxsize=MAX_PENDING_CHUNKS)
+        write_queue: Queue = Queue(maxsize=MAX_PENDING_CHUNKS)
+        read_errors: List[BaseException] = []
+        lookup_errors: List[Tuple[int, Tuple, Tuple, Exception]] = []
+        # One reader thread, and lookup workers using one pooled connection each.
+        # Daemon threads, so a failure while writing cannot leave them blocked on a full queue.
+        threads = [threading.Thread(target=self._read_stage, args=(read_queue, write_queue, read_errors),
+                                    daemon=True)]
+        threads += [threading.Thread(target=self._lookup_stage, args=(read_queue, write_queue, lookup_errors),
+                                     daemon=True)
+                    for _ in range(MAX_WORKERS)]
+        for thread in threads:
+            thread.start()
+
+        # Write on this thread until every worker has finished
+        with self.writer as writer:
+            writer.write_header(header + missing_output_columns(header))
+
+            finished_workers = 0
+            while finished_workers < MAX_WORKERS:
+                rows = write_queue.get()
+                if rows is None:
+                    finished_workers += 1
+                else:
+                    writer.write_rows(rows)
+
+        for thread in threads:
+            thread.join()
+
+        for count, first_row, last_row, error in lookup_errors:
+            logger.error("Dropped %d rows that failed to resolve, first row %s, last row %s",
+                         count, first_row, last_row, exc_info=error)
+        if lookup_errors:
+            failed_rows = sum(count for count, _, _, _ in lookup_errors)
+            logger.error("Failed to process %d rows in %d chunks", failed_rows, len(lookup_errors))
+        if read_errors:
+            raise read_errors[0]
+
+
+class CopyDataProcessor:
+    """Processes the input CSV by joining it to the lookup tables inside PostgreSQL, loaded and unloaded with COPY"""
+    
+    def __init__(self, db: PostgreSQLDatabase, input_path: str, output_path: str):
+        self.db = db
+        self.input_path = input_path
+        self.output_path = output_path
 
     def process_data(self):
-        """Reads, processes, and writes data efficiently with parallel execution"""
-        results = []
-
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            # Read and process rows concurrently
-            future_to_row = {executor.submit(self.process_row, row): row for row in self.reader.read_rows()}
-            
-            for future in future_to_row:
-                try:
-                    results.append(future.result())
-                except Exception as e:
-                    print(f"Error processing row {future_to_row[future]}: {e}")
+        """Copies the input into the database and the joined gid/eid results back out"""
+        reader = CSVFileReader(self.input_path)
+        header = reader.read_header()
+        if not header:
+            print("No data to write.")
+            return
 
-        # Write results to output CSV
-        self.writer.write_rows(results)
+        # Find the input columns up front, so a bad header fails before anything is copied
+        query = copy_join_query(header)
+
+        # Rows go through the CSV reader, so blank lines and uneven rows are handled as in
+        # DataProcessor, and the temporary table gets one column per position (names may repeat)
+        columns = [f"column_{index}" for index in range(len(header))]
+        source = CSVRowStream(reader.read_rows(), len(header))
+        with open(self.output_path, mode="w", newline="", encoding="utf-8", buffering=IO_BUFFER_SIZE) as destination:
+            self.db.copy_join(columns, source, destination, query)
 
 
 # --------------------- Run the Program ---------------------
 
 if __name__ == "__main__":
-    db_instance = PostgreSQLDatabase(DB_CONFIG)
-    csv_reader = CSVFileReader(INPUT_CSV_FILE)
+    logging.basicConfig(level=logging.INFO)
+
+    if DB_BACKEND == "asyncpg" and not USE_COPY:
+        db_instance = AsyncPGDatabase(DB_CONFIG)
+    else:
+        db_instance = PostgreSQLDatabase(DB_CONFIG)
+    csv_reader = ArrowCSVReader(INPUT_CSV_FILE) if CSV_READER == "pyarrow" else CSVFileReader(INPUT_CSV_FILE)
     csv_writer = CSVFileWriter(OUTPUT_CSV_FILE)
 
-    processor = DataProcessor(db_instance, csv_reader, csv_writer)
+    if USE_COPY:
+        processor = CopyDataProcessor(db_instance, INPUT_CSV_FILE, OUTPUT_CSV_FILE)
+    else:
+        processor = DataProcessor(db_instance, csv_reader, csv_writer)
     
     try:
         processor.process_data()